@@ -1,5 +1,201 @@
 """TinyDB helper layer – extend as needed."""
+import os
+
+import orjson
 from tinydb import TinyDB
+from tinydb.table import Table
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage
+
+
+class OrjsonStorage(JSONStorage):
+    """JSONStorage that parses/serialises raw bytes with orjson."""
+
+    def __init__(self, path: str, create_dirs: bool = False, access_mode: str = "rb+"):
+        super().__init__(path, create_dirs=create_dirs, access_mode=access_mode)
+
+    def read(self):
+        self._handle.seek(0)
+        data = self._handle.read()
+        return orjson.loads(data) if data else None
+
+    def write(self, data) -> None:
+        self._handle.seek(0)
+        self._handle.write(orjson.dumps(data))
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.truncate()
+
 
 def get_db(path: str = "tracker_db.json") -> TinyDB:
-    return TinyDB(path)
\ No newline at end of file
+    """Open the DB with writes buffered in memory until `db.storage.flush()`."""
+    return TinyDB(path, storage=CachingMiddleware(OrjsonStorage))
+
+
+class IndexedTable:
+    """TinyDB table wrapper with in-memory secondary indexes.
+
+    Each index is a plain dict of field value → set of doc_ids, so an
+    equality lookup is a hash hit. TinyDB has no schema and a field may
+    mix types (e.g. int chapter numbers and "Prologue"), so ordering is
+    only applied in `index_keys()`. Indexes are built lazily on first
+    lookup and then kept current by every write method (`insert*`,
+    `update*`, `upsert`, `remove`, `truncate`).
+    Docs missing a field (or holding None) are left out of its index.
+    Everything else is passed through to the wrapped table.
+    """
+
+    def __init__(self, table: Table, fields=()):
+        self._table = table
+        self._fields: list[str] = []
+        self._indexes: dict[str, dict] | None = None
+        for field in fields:
+            self.create_index(field)
+
+    def __getattr__(self, name):
+        return getattr(self._table, name)
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __iter__(self):
+        return iter(self._table)
+
+    # -- index maintenance ------------------------------------------
+    def create_index(self, field: str) -> None:
+        if field not in self._fields:
+            self._fields.append(field)
+            self._indexes = None
+
+    def _index(self, field: str) -> dict:
+        if self._indexes is None:
+            # Build off to the side and publish in one assignment, so no
+            # other reader ever sees a half-filled index.
+            indexes = {f: {} for f in self._fields}
+            for doc in self._table:
+                _add_to(indexes, doc, doc.doc_id)
+            self._indexes = indexes
+        return self._indexes[field]
+
+    def _add(self, doc, doc_id: int) -> None:
+        _add_to(self._indexes, doc, doc_id)
+
+    def _discard(self, doc, doc_id: int) -> None:
+        for field, index in self._indexes.items():
+            ids = index.get(doc.get(field))
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del index[doc.get(field)]
+
+    # -- lookups ----------------------------------------------------
+    def has_value(self, field: str, value) -> bool:
+        return value in self._index(field)
+
+    def index_keys(self, field: str) -> list:
+        """Distinct values of `field`: numbers in order, then the rest by text."""
+        return sorted(self._index(field), key=_mixed_sort_key)
+
+    # -- writes -----------------------------------------------------
+    def insert(self, document) -> int:
+        doc_id = self._table.insert(document)
+        if self._indexes is not None:
+            self._add(document, doc_id)
+        return doc_id
+
+    def insert_multiple(self, documents) -> list[int]:
+        documents = list(documents)
+        doc_ids = self._table.insert_multiple(documents)
+        if self._indexes is not None:
+            for doc, doc_id in zip(documents, doc_ids):
+                self._add(doc, doc_id)
+        return doc_ids
+
+    def update(self, fields, cond=None, doc_ids=None) -> list[int]:
+        if self._indexes is None or (
+            not callable(fields) and not set(fields) & set(self._fields)
+        ):
+            return self._table.update(fields, cond=cond, doc_ids=doc_ids)
+        if doc_ids is None:
+            self._indexes = None  # can't tell which docs change – rebuild lazily
+            return self._table.update(fields, cond=cond)
+        for doc_id in doc_ids:
+            self._discard(self._table.get(doc_id=doc_id), doc_id)
+        updated = self._table.update(fields, doc_ids=doc_ids)
+        for doc_id in updated:
+            self._add(self._table.get(doc_id=doc_id), doc_id)
+        return updated
+
+    def remove(self, cond=None, doc_ids=None) -> list[int]:
+        if self._indexes is not None:
+            if doc_ids is None:
+                self._indexes = None
+            else:
+                for doc_id in doc_ids:
+                    self._discard(self._table.get(doc_id=doc_id), doc_id)
+        return self._table.remove(cond=cond, doc_ids=doc_ids)
+
+    def update_multiple(self, updates) -> list[int]:
+        self._indexes = None  # arbitrary conditions – rebuild lazily
+        return self._table.update_multiple(updates)
+
+    def upsert(self, document, cond=None) -> list[int]:
+        self._indexes = None  # may insert or update – rebuild lazily
+        return self._table.upsert(document, cond=cond)
+
+    def truncate(self) -> None:
+        self._table.truncate()
+        self._indexes = {f: {} for f in self._fields}
+
+
+def _add_to(indexes: dict, doc, doc_id: int) -> None:
+    for field, index in indexes.items():
+        value = doc.get(field)
+        if value is not None:
+            index.setdefault(value, set()).add(doc_id)
+
+
+def _mixed_sort_key(value) -> tuple:
+    if isinstance(value, (int, float)):
+        return (0, value, "")
+    return (1, 0, str(value))
+
+
+def get_indexed_table(db: TinyDB, name: str, *fields: str) -> IndexedTable:
+    return IndexedTable(db.table(name), fields)
+
+
+def sync_table(
+    table, before: dict[int, dict], after: list[dict], id_field: str = "doc_id"
+) -> None:
+    """Write only the rows that changed between `before` and `after`.
+
+    `before` maps doc_id → fields as loaded; each row in `after` carries
+    its doc_id under `id_field` (None for rows added since loading).
+    `before` may be stale – another session can have deleted rows since –
+    so ids no longer in the table are never passed to update/remove
+    (TinyDB raises KeyError for them); an edited row whose doc is gone is
+    inserted afresh instead.
+    """
+    added, seen = [], set()
+    for row in after:
+        fields = {k: v for k, v in row.items() if k != id_field}
+        doc_id = row.get(id_field)
+        if doc_id not in before:
+            added.append(fields)
+            continue
+        seen.add(doc_id)
+        if before[doc_id] == fields:
+            continue
+        if table.contains(doc_id=doc_id):
+            table.update(fields, doc_ids=[doc_id])
+        else:
+            added.append(fields)
+    removed = [
+        doc_id for doc_id in before
+        if doc_id not in seen and table.contains(doc_id=doc_id)
+    ]
+    if removed:
+        table.remove(doc_ids=removed)
+    if added:
+        table.insert_multiple(added)
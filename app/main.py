@@ -3,244 +3,448 @@ Novel-Forge Tracker v2.0  —  Streamlit front-end + TinyDB persistence
 Fully pandas-powered version (fixes st.data_editor() type-compat errors)
 """
 
-import json
+import os
+import logging
+import threading
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
+import orjson
 import pandas as pd              # ← NEW
 import streamlit as st
-from tinydb import TinyDB
+
+from db import get_db, get_indexed_table, sync_table
+
+log = logging.getLogger(__name__)
+
 
 # ------------------------------------------------------------------
 # 🔖 CONFIG
 # ------------------------------------------------------------------
 DATA_DIR = Path(__file__).parent / "data"
-DATA_DIR.mkdir(exist_ok=True)
 DB_FILE = DATA_DIR / "tracker_db.json"
 SNAPSHOT_DIR = DATA_DIR / "snapshots"
-SNAPSHOT_DIR.mkdir(exist_ok=True)
 MAX_SNAPSHOTS = 5
 
-STATUS_OPTS = ["Not Started", "Draft", "Line-Edits", "✅ Done"]
+DATE_COLS = ("deadline", "last_edited")  # date-only: DateColumn in, ISO date out
+STATUS_DONE = "✅ Done"
+STATUS_OPTS = ["Not Started", "Draft", "Line-Edits", STATUS_DONE]
 PRIORITY_EMOJIS = {"🟥": "High", "🟧": "Medium-High", "🟨": "Medium", "🟩": "Low"}
+STATUS_OPTS_T = tuple(STATUS_OPTS)
+PRIORITY_OPTS_T = tuple(PRIORITY_EMOJIS)
+FOCUS_OPTS_T = ("", "Pacing", "World-building", "Prose Sparkle", "Character Arc", "Theme")
+
+# Grid column configs are static – build them once, not per rerun
+CHAPTERS_COLUMN_CONFIG = {
+    "doc_id":   None,
+    "status":   st.column_config.SelectboxColumn("Status",  options=STATUS_OPTS_T),
+    "priority": st.column_config.SelectboxColumn("Priority", options=PRIORITY_OPTS_T),
+    "deadline": st.column_config.DateColumn("Deadline"),
+    "last_edited": st.column_config.DateColumn("Last edited"),
+}
+PASSES_COLUMN_CONFIG_BASE = {
+    "doc_id": None,
+    "focus":  st.column_config.SelectboxColumn("Focus", options=FOCUS_OPTS_T),
+    "status": st.column_config.CheckboxColumn("Done?"),
+}
+TODOS_COLUMN_CONFIG = {
+    "doc_id": None,
+    "task": st.column_config.TextColumn("Task"),
+    "done": st.column_config.CheckboxColumn("✓"),
+}
+
+# 👷 One blank row so an empty table still has an editable schema
+BLANK_ROWS = {
+    "passes": {"doc_id": None, "focus": "", "status": False, "chapter": ""},
+    "todos": {"doc_id": None, "task": "", "done": False},
+}
 
-st.set_page_config(
-    page_title="Novel-Forge Tracker v2.0",
-    layout="wide",
-    initial_sidebar_state="expanded",
-)
 
 # Inject CSS -------------------------------------------------------
-css = (Path(__file__).parent / "assets" / "styles.css").read_text()
-st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
+@st.cache_resource
+def _css() -> str:
+    """Read the stylesheet once per process, not once per rerun."""
+    return (Path(__file__).parent / "assets" / "styles.css").read_text()
+
+
+def inject_assets() -> None:
+    st.markdown(f"<style>{_css()}</style>", unsafe_allow_html=True)
+    st.markdown(
+        "<script src='assets/appear.js'></script>",
+        unsafe_allow_html=True
+    )
 
-st.markdown(
-    "<script src='assets/appear.js'></script>",
-    unsafe_allow_html=True
-)
 
 # ------------------------------------------------------------------
 # 🗄️ DATABASE
 # ------------------------------------------------------------------
-db = TinyDB(DB_FILE)
-chapters_table = db.table("chapters")
-todos_table = db.table("todos")
-passes_table = db.table("edit_passes")
+@st.cache_resource
+def get_tables():
+    """Open the DB on first use and share it across sessions and reruns.
+
+    Returns (db, chapters, todos, passes, lock). Every session thread
+    shares the one DB, cache and index, so writes (and anything that
+    walks the live storage dict) must hold `lock`.
+    """
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    db = get_db(DB_FILE)
+    return (
+        db,
+        get_indexed_table(db, "chapters", "#", "status"),
+        db.table("todos"),
+        db.table("edit_passes"),
+        threading.Lock(),
+    )
 
 
+@st.cache_resource
+def _demo_chapters() -> list[dict]:
+    """Parse the bundled demo set once per process."""
+    return orjson.loads(
+        (Path(__file__).parent / "assets" / "test_data.json").read_bytes()
+    )
+
+
+@st.cache_resource
 def load_demo_data() -> None:
     """Populate DB with three-chapter demo set on first run."""
-    if len(chapters_table) == 0:
-        demo = json.loads(
-            (Path(__file__).parent / "assets" / "test_data.json").read_text()
-        )
-        chapters_table.insert_multiple(demo)
-
+    db, chapters_table, _, _, lock = get_tables()
+    with lock:
+        if len(chapters_table) == 0:
+            chapters_table.insert_multiple(_demo_chapters())
+            db.storage.flush()
 
-load_demo_data()
 
 # ------------------------------------------------------------------
 # 🔄 SNAPSHOTS (autosave once per day)
 # ------------------------------------------------------------------
+# O_DSYNC commits data with each write(); O_BINARY stops Windows text mode
+_SNAP_FLAGS = (
+    os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    | getattr(os, "O_DSYNC", 0) | getattr(os, "O_BINARY", 0)
+)
+
+
+def write_durable(path: Path, data: bytes) -> None:
+    """Write `data` to `path` and return only once it has reached the disk.
+
+    The bytes land in a sibling `.tmp` file that is renamed into place
+    only when complete, so `path.exists()` never sees a partial snapshot;
+    on POSIX the directory is then fsynced so the rename itself is durable.
+    """
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        fd = os.open(tmp, _SNAP_FLAGS, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    if os.name == "posix":
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+@st.cache_resource
+def _snap_pool() -> ThreadPoolExecutor:
+    """Single background writer shared by all sessions."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot")
+
+
+def _write_snapshot(snap_file: Path, data: bytes) -> None:
+    write_durable(snap_file, data)
+    # ISO-dated names sort chronologically; scandir skips glob's stat()s
+    snaps = sorted(
+        (e.name, e.path) for e in os.scandir(SNAPSHOT_DIR) if e.name.endswith(".json")
+    )
+    for _, old in snaps[:-MAX_SNAPSHOTS]:
+        os.unlink(old)
+
+
+def _log_snapshot_error(future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        log.error("Daily snapshot failed", exc_info=future.exception())
+
+
 def autosave() -> None:
     today = dt.date.today().isoformat()
     snap_file = SNAPSHOT_DIR / f"{today}.json"
     if not snap_file.exists():
-        with open(snap_file, "w") as f:
-            json.dump(db.all(), f, indent=2)
-        snaps = sorted(SNAPSHOT_DIR.glob("*.json"))
-        for old in snaps[:-MAX_SNAPSHOTS]:
-            old.unlink()
-
+        # The shared CachingMiddleware already holds the raw
+        # tables→doc_id→doc dict, so dump that – no disk read, no Documents.
+        # Serialise here (the dict is live); only the synced write is offloaded.
+        db, *_, lock = get_tables()
+        with lock:
+            data = orjson.dumps(db.storage.read(), option=orjson.OPT_INDENT_2)
+        future = _snap_pool().submit(_write_snapshot, snap_file, data)
+        future.add_done_callback(_log_snapshot_error)
+
+
+def autosave_daily() -> None:
+    """autosave() at most once per session per day – one dict lookup per rerun."""
+    today = dt.date.today().isoformat()
+    if st.session_state.get("_snap_date") != today:
+        autosave()
+        st.session_state["_snap_date"] = today
 
-autosave()
 
 # ------------------------------------------------------------------
 # 🧮 HELPERS
 # ------------------------------------------------------------------
+def db_mtime() -> int:
+    """Cache key that changes whenever TinyDB rewrites the DB file."""
+    return DB_FILE.stat().st_mtime_ns
+
+
+@st.cache_data(show_spinner=False)
+def load_all(table_name: str, mtime: int) -> pd.DataFrame:
+    """Read a whole table once per DB write (`mtime` busts the cache).
+
+    Dtypes are normalised here, once, so the tabs can hand the frame
+    straight to st.data_editor: date-ish columns become datetime64 and
+    everything else gets pandas' nullable dtypes (NA instead of NaN).
+    Each row keeps its TinyDB id in a `doc_id` column so Save can diff.
+    """
+    docs = get_tables()[0].table(table_name).all()
+    df = pd.DataFrame(docs)
+    df.insert(0, "doc_id", [doc.doc_id for doc in docs])
+    for col in DATE_COLS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    return df.convert_dtypes()
+
+
+def to_records(df: pd.DataFrame) -> list[dict]:
+    """DataFrame → JSON-safe dicts for TinyDB (ISO dates, None for NA/NaT)."""
+    out = df.copy()
+    for col in out.select_dtypes("datetime").columns:
+        out[col] = out[col].dt.strftime("%Y-%m-%d")
+    return out.astype(object).where(out.notna(), None).to_dict("records")
+
+
+def compute_totals(df: pd.DataFrame) -> tuple[int, int]:
+    """Return (current words, words at project start) for all chapters."""
+    if "word_count" not in df.columns:
+        return 0, 0
+    words = df["word_count"].fillna(0)
+    start = df["start_words"].fillna(words) if "start_words" in df.columns else words
+    return (
+        int(words.to_numpy(np.int64).sum()),
+        int(start.fillna(0).to_numpy(np.int64).sum()),
+    )
+
+
+def chapter_totals() -> tuple[int, int]:
+    """compute_totals() memoised on the identity of `chapters_df`."""
+    df = st.session_state["chapters_df"]
+    if st.session_state.get("_totals_src") is not df:
+        st.session_state["_totals"] = compute_totals(df)
+        st.session_state["_totals_src"] = df
+    return st.session_state["_totals"]
+
+
+@st.cache_resource
+def passes_column_config(options: tuple) -> dict:
+    """Passes grid config; only rebuilt when the set of chapters changes."""
+    return {
+        **PASSES_COLUMN_CONFIG_BASE,
+        "chapter": st.column_config.SelectboxColumn("Chapter #", options=options),
+    }
+
+
+def chapter_options(chapters_table) -> tuple:
+    """Passes dropdown options: blank + every chapter number, as one tuple."""
+    with get_tables()[4]:
+        return ("",) + tuple(chapters_table.index_keys("#"))
+
+
+def load_table(key: str, table) -> pd.DataFrame:
+    """Fresh frame for `table`; its rows are kept in `<key>_orig` for diffing."""
+    df = load_all(table.name, db_mtime())
+    st.session_state[f"{key}_orig"] = {r.pop("doc_id"): r for r in to_records(df)}
+    if df.empty and key in BLANK_ROWS:
+        df = pd.DataFrame([BLANK_ROWS[key]]).convert_dtypes()
+    return df
+
+
+def save_table(
+    key: str,
+    table,
+    df: pd.DataFrame,
+    require_col: str | None = None,
+    drop_blank: bool = False,
+) -> list[dict]:
+    """Persist an edited frame: filter, diff against `<key>_orig`, flush once.
+
+    `require_col` keeps only rows with a non-empty value there;
+    `drop_blank` drops rows whose every (non-doc_id) cell is empty.
+    Reloads `<key>_df` afterwards and returns the records written.
+    """
+    if require_col:
+        df = df[df[require_col].notna() & (df[require_col] != "")]
+    if drop_blank:
+        content = df.drop(columns="doc_id", errors="ignore")
+        df = df[(content.notna() & (content.astype(str) != "")).any(axis=1)]
+    records = to_records(df)
+    db, *_, lock = get_tables()
+    with lock:
+        sync_table(table, st.session_state[f"{key}_orig"], records)
+        db.storage.flush()
+        load_all.clear()
+        st.session_state[f"{key}_df"] = load_table(key, table)
+    autosave()
+    return records
+
+
 def refresh_session() -> None:
-    """Load DB rows into session_state so edits persist live."""
+    """Load each table into session_state once, as the DataFrame the tab edits.
+
+    Frames stay the source of truth between reruns; they only go back to
+    records (via to_records) when a Save button writes them to TinyDB.
+    """
+    _, chapters_table, todos_table, passes_table, _ = get_tables()
     mapping = {
         "chapters": chapters_table,
         "todos": todos_table,
         "passes": passes_table,
     }
     for key, table in mapping.items():
-        if key not in st.session_state:
-            st.session_state[key] = table.all()
-
+        if f"{key}_df" not in st.session_state:
+            st.session_state[f"{key}_df"] = load_table(key, table)
+    if "chapter_numbers_t" not in st.session_state:
+        st.session_state["chapter_numbers_t"] = chapter_options(chapters_table)
 
-refresh_session()
 
 # ------------------------------------------------------------------
 # 🚀 SIDEBAR  –  Word-count dashboard
 # ------------------------------------------------------------------
-with st.sidebar:
-    st.header("📊 Word-Count Dashboard")
-    total_words = sum(ch.get("word_count", 0) for ch in st.session_state["chapters"])
-    start_words = sum(
-        ch.get("start_words", ch.get("word_count", 0)) for ch in st.session_state["chapters"]
-    )
-    delta = total_words - start_words
-    target_words = st.number_input("Target total words", 0, 500_000, value=90_000)
-    st.metric("Current words", f"{total_words:,}")
-    st.metric("Δ since project start", f"{delta:+,}")
-    st.progress(min(total_words / target_words, 1.0))
-    st.divider()
-    st.toggle("🌙 Dark mode")
+def render_sidebar() -> None:
+    autosave_daily()
+    with st.sidebar:
+        st.header("📊 Word-Count Dashboard")
+        total_words, start_words = chapter_totals()
+        delta = total_words - start_words
+        target_words = st.number_input("Target total words", 0, 500_000, value=90_000)
+        st.metric("Current words", f"{total_words:,}")
+        st.metric("Δ since project start", f"{delta:+,}")
+        st.progress(min(total_words / target_words, 1.0))
+        st.divider()
+        st.toggle("🌙 Dark mode")
 
 
-# ------------------------------------------------------------------
-# 🗂️ MAIN TABS
-# ------------------------------------------------------------------
-tabs = st.tabs(["📖 Chapters", "🪄 Editing Passes", "✅ To-Dos", "📥 Import Wizard"])
-
 # ------------------------------------------------------------------
 # 1️⃣ CHAPTERS TAB
 # ------------------------------------------------------------------
-with tabs[0]:
+def render_chapters_tab() -> None:
+    chapters_table = get_tables()[1]
     st.subheader("Chapter Progress")
 
-    chapters_df = pd.DataFrame(st.session_state["chapters"])
-
-    # 🔧 NEW: make sure date-ish columns are really datetime
-    for col in ["deadline", "last_edited"]:
-        if col in chapters_df.columns:
-            chapters_df[col] = pd.to_datetime(chapters_df[col], errors="coerce")
-
     edited_chapters = st.data_editor(
-        chapters_df,
+        st.session_state["chapters_df"],
         num_rows="dynamic",
-        column_config={
-            "status":   st.column_config.SelectboxColumn("Status",  options=STATUS_OPTS),
-            "priority": st.column_config.SelectboxColumn("Priority", options=list(PRIORITY_EMOJIS)),
-            "deadline": st.column_config.DateColumn("Deadline"),
-        },
+        column_config=CHAPTERS_COLUMN_CONFIG,
         use_container_width=True,
         key="chapters_editor",
     )
     if st.button("💾 Save chapters"):
-        records = edited_chapters.to_dict("records")
-        chapters_table.truncate()
-        chapters_table.insert_multiple(records)
-        st.session_state["chapters"] = records
-        autosave()
+        save_table("chapters", chapters_table, edited_chapters)
+        st.session_state["chapter_numbers_t"] = chapter_options(chapters_table)
 
-        if any(r["status"] == "✅ Done" for r in records):
+        if chapters_table.has_value("status", STATUS_DONE):
             st.balloons()
             st.success('Kaela sneers: “About bloody time you wrapped one up.”')
 
+
 # ------------------------------------------------------------------
 # 2️⃣ EDITING-PASSES TAB
 # ------------------------------------------------------------------
-with tabs[1]:
+def render_passes_tab() -> None:
+    passes_table = get_tables()[3]
     st.subheader("Focus-Area Board")
 
-    passes_df = pd.DataFrame(st.session_state["passes"])
-
-    # 👷 Ensure an editable schema exists
-    if passes_df.empty:
-        passes_df = pd.DataFrame(
-            [
-                {
-                    "focus": "",
-                    "status": False,
-                    "chapter": "",
-                }
-            ]
-        )
-
-    # 🚑 Replace NaN with None for Streamlit friendliness
-    passes_df = passes_df.astype(object).where(~passes_df.isna(), None)
-
     edited_passes = st.data_editor(
-        passes_df,
+        st.session_state["passes_df"],
         num_rows="dynamic",
-        column_config={
-            "focus": st.column_config.SelectboxColumn(
-                "Focus",
-                options=["", "Pacing", "World-building", "Prose Sparkle", "Character Arc", "Theme"],
-            ),
-            "status":  st.column_config.CheckboxColumn("Done?"),
-            "chapter": st.column_config.SelectboxColumn(
-                "Chapter #", options=[""] + [c["#"] for c in st.session_state["chapters"]]
-            ),
-        },
+        column_config=passes_column_config(
+            st.session_state.get("chapter_numbers_t", ("",))
+        ),
         use_container_width=True,
         key="passes_editor",
     )
 
     if st.button("💾 Save passes"):
         # ignore blank rows
-        records = [
-            r for r in edited_passes.to_dict("records")
-            if any(v not in ("", None) for v in r.values())
-        ]
-        passes_table.truncate()
-        passes_table.insert_multiple(records)
-        st.session_state["passes"] = records
-        autosave()
+        save_table("passes", passes_table, edited_passes, drop_blank=True)
+
+
 # ------------------------------------------------------------------
 # 3️⃣ TO-DO LIST TAB
 # ------------------------------------------------------------------
-with tabs[2]:
+def render_todos_tab() -> None:
+    todos_table = get_tables()[2]
     st.subheader("Master To-Do")
 
-    todos_df = pd.DataFrame(st.session_state["todos"])
-
-    # 👷 Ensure there’s at least a schema so the grid is editable
-    if todos_df.empty:
-        todos_df = pd.DataFrame([{"task": "", "done": False}])
-
-    # 🚑 Streamlit dislikes NaN/NaT – normalise them
-    todos_df = todos_df.astype(object).where(~todos_df.isna(), None)
-
     edited_todos = st.data_editor(
-        todos_df,
+        st.session_state["todos_df"],
         num_rows="dynamic",
-        column_config={
-            "task": st.column_config.TextColumn("Task"),
-            "done": st.column_config.CheckboxColumn("✓"),
-        },
+        column_config=TODOS_COLUMN_CONFIG,
         use_container_width=True,
         key="todos_editor",
     )
 
     if st.button("💾 Save todos"):
-        records = [r for r in edited_todos.to_dict("records") if r.get("task")]
-        todos_table.truncate()
-        todos_table.insert_multiple(records)
-        st.session_state["todos"] = records
-        autosave()
+        save_table("todos", todos_table, edited_todos, require_col="task")
+
 
 # ------------------------------------------------------------------
 # 4️⃣ IMPORT WIZARD TAB  (stub)
 # ------------------------------------------------------------------
-with tabs[3]:
+def render_import_tab() -> None:
     st.subheader("Import Wizard")
     st.info("Upload a `.docx` or paste a Google Doc URL. Parser stubs live in `services/importers.py`.")
     st.file_uploader("Choose .docx", type=["docx"])
     st.text_input("…or Google Docs URL")
     st.warning("Importer not wired yet—go implement it!")
 
-st.caption("© 2025 Novel-Forge Tracker v2.0  |  Built with Streamlit 💜")
+
+# ------------------------------------------------------------------
+# 🗂️ MAIN TABS
+# ------------------------------------------------------------------
+def render_tabs() -> None:
+    tabs = st.tabs(["📖 Chapters", "🪄 Editing Passes", "✅ To-Dos", "📥 Import Wizard"])
+    for tab, render in zip(
+        tabs, (render_chapters_tab, render_passes_tab, render_todos_tab, render_import_tab)
+    ):
+        with tab:
+            render()
+
+
+# ------------------------------------------------------------------
+# 🏁 ENTRY POINT
+# ------------------------------------------------------------------
+def main() -> None:
+    st.set_page_config(
+        page_title="Novel-Forge Tracker v2.0",
+        layout="wide",
+        initial_sidebar_state="expanded",
+    )
+    inject_assets()
+    load_demo_data()
+    refresh_session()
+    render_sidebar()
+    render_tabs()
+    st.caption("© 2025 Novel-Forge Tracker v2.0  |  Built with Streamlit 💜")
+
+
+if __name__ == "__main__":
+    main()